@@ -0,0 +1,235 @@
+"""
+签名、验签、通知解析与网址校验等热点路径的微基准测试
+
+对每个用例测量每秒操作数（ops/s）与单次操作的内存分配峰值（tracemalloc），并与 baseline.json 比较：
+相对速度低于基线或分配峰值高于基线超过 threshold 时视为性能回退，以非零状态退出
+
+相对速度为用例与固定参考负载交替测量时每轮 ops/s 之比的中位数，用于抵消机器性能与负载带来的差异
+
+用法：
+    python benchmarks/micro.py                    # 与基线比较
+    python benchmarks/micro.py --threshold 0.1    # 允许 10% 的波动
+    python benchmarks/micro.py --update           # 重新生成基线
+    python benchmarks/micro.py --only get_signature
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from hashlib import md5
+from urllib.parse import urlencode
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payjs import PayJS, PayJSNotify  # noqa: E402
+from payjs.sign import get_signature, check_signature  # noqa: E402
+from payjs.utils import check_url  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+MCHID = '1234567890'
+KEY = 'b8Ue0XmPLsHqD2vR7nTc4KwZ'
+
+# 与 payjs.cn 实际收发内容一致的负载
+
+NATIVE_REQUEST = {
+    'mchid': MCHID,
+    'total_fee': 1280,
+    'out_trade_no': '20260101123045000123',
+    'body': '会员月卡（30 天）',
+    'notify_url': 'https://pay.example.com/payjs/notify/',
+    'attach': '{"uid": 10086, "plan": "monthly"}',
+}
+
+
+def _signed(data):
+    data = dict(data)
+    data['sign'] = get_signature(KEY, data)
+    return data
+
+
+CHECK_RESPONSE = _signed({
+    'return_code': 1,
+    'mchid': MCHID,
+    'out_trade_no': '20260101123045000123',
+    'payjs_order_id': '2026010112304500012345678',
+    'transaction_id': '4200000123202601011234567890',
+    'status': 1,
+    'openid': 'o7LFAwUGxxxxxxxxxxxxxxxxxxxx',
+    'total_fee': 1280,
+    'paid_time': '2026-01-01 12:31:02',
+    'attach': '{"uid": 10086, "plan": "monthly"}',
+})
+
+NOTIFY = _signed({
+    'return_code': '1',
+    'total_fee': '1280',
+    'out_trade_no': '20260101123045000123',
+    'payjs_order_id': '2026010112304500012345678',
+    'transaction_id': '4200000123202601011234567890',
+    'time_end': '2026-01-01 12:31:02',
+    'openid': 'o7LFAwUGxxxxxxxxxxxxxxxxxxxx',
+    'attach': '{"uid": 10086, "plan": "monthly"}',
+    'mchid': MCHID,
+})
+
+NOTIFY_BODY = urlencode(NOTIFY)
+
+URLS = (
+    'https://pay.example.com/payjs/notify/',
+    'https://xn--fiqs8s.xn--fiqz9s/notify/',
+    'https://203.0.113.17:8443/api/payjs/notify/',
+)
+
+
+def _response(data, url):
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r._content = json.dumps(data).encode()
+    return r
+
+
+CLIENT = PayJS(MCHID, KEY)
+CHECK_RAW_RESPONSE = _response(CHECK_RESPONSE, CLIENT.API_BASE + '/check')
+
+CASES = {
+    'get_signature': lambda: get_signature(KEY, NATIVE_REQUEST),
+    'check_signature': lambda: check_signature(KEY, CHECK_RESPONSE),
+    'check_url': lambda: [check_url(url) for url in URLS],
+    'notify_dict': lambda: PayJSNotify(KEY, NOTIFY),
+    'notify_str': lambda: PayJSNotify(KEY, NOTIFY_BODY),
+    'parse_response': lambda: CLIENT.parse_response(CHECK_RAW_RESPONSE),
+}
+
+
+def reference():
+    """
+    固定的参考负载（排序、格式化与哈希），不依赖 payjs 的代码
+    """
+    items = sorted(('k{}'.format(i * 7919 % 31), i) for i in range(24))
+    md5('&'.join('{}={}'.format(k, v) for k, v in items).encode()).hexdigest()
+
+
+def _calibrate(timer, min_time):
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return number
+
+
+def measure_ops(func, repeat=15, min_time=0.05):
+    """
+    每秒操作数与相对速度
+
+    用例与参考负载交替运行 repeat 轮，ops/s 取最快的一轮，相对速度取每轮之比的中位数
+
+    :return: (ops/s, 相对速度)
+    """
+    timer = timeit.Timer(func)
+    reference_timer = timeit.Timer(reference)
+    number = _calibrate(timer, min_time)
+    reference_number = _calibrate(reference_timer, min_time)
+
+    ops = []
+    ratios = []
+    for _ in range(repeat):
+        reference_ops = reference_number / reference_timer.timeit(reference_number)
+        ops.append(number / timer.timeit(number))
+        ratios.append(ops[-1] / reference_ops)
+    return max(ops), statistics.median(ratios)
+
+
+def measure_alloc(func, repeat=5):
+    """
+    单次操作的内存分配峰值（字节，取中位数）
+    """
+    func()  # 预热缓存（正则、编码器等）
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            tracemalloc.clear_traces()
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks))
+
+
+def run(names):
+    results = {}
+    for name in names:
+        ops, relative = measure_ops(CASES[name])
+        results[name] = {'ops': ops, 'relative': relative, 'alloc': measure_alloc(CASES[name])}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: 回退的用例说明列表
+    """
+    regressions = []
+    print('{:<16} {:>10} {:>9} {:>9} {:>8} {:>9} {:>9} {:>8}'.format(
+        'case', 'ops/s', 'relative', 'base', 'delta', 'alloc B', 'base B', 'delta'))
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            print('{:<16} {:>10.0f} {:>9.3f} {:>9} {:>8} {:>9} {:>9} {:>8}'.format(
+                name, r['ops'], r['relative'], '-', '-', r['alloc'], '-', '-'))
+            continue
+
+        speed_delta = r['relative'] / b['relative'] - 1
+        alloc_delta = r['alloc'] / b['alloc'] - 1 if b['alloc'] else 0
+        print('{:<16} {:>10.0f} {:>9.3f} {:>9.3f} {:>+7.1%} {:>9} {:>9} {:>+7.1%}'.format(
+            name, r['ops'], r['relative'], b['relative'], speed_delta, r['alloc'], b['alloc'], alloc_delta))
+
+        if speed_delta < -threshold:
+            regressions.append('{}: speed {:+.1%}'.format(name, speed_delta))
+        if alloc_delta > threshold:
+            regressions.append('{}: alloc {:+.1%}'.format(name, alloc_delta))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--baseline', default=BASELINE, help='基线文件路径')
+    parser.add_argument('--threshold', type=float, default=0.25, help='允许的相对回退幅度（默认为 0.25）')
+    parser.add_argument('--update', action='store_true', help='将本次结果写入基线文件')
+    parser.add_argument('--only', action='append', choices=sorted(CASES), help='只运行指定用例（可重复）')
+    args = parser.parse_args()
+
+    results = run(args.only or list(CASES))
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update:
+        baseline.update({name: {'ops': round(r['ops']), 'relative': round(r['relative'], 4), 'alloc': r['alloc']}
+                         for name, r in results.items()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('基线已写入 {}'.format(args.baseline))
+        return 0
+
+    if regressions:
+        print('性能回退（阈值 {:.0%}）：'.format(args.threshold))
+        for r in regressions:
+            print('  ' + r)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
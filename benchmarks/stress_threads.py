@@ -0,0 +1,111 @@
+"""
+多线程共享同一个 PayJS 实例的压力测试
+
+在本地启动一个模拟 payjs.cn 的 HTTP 服务（每个请求带有固定的模拟网络延迟），
+用 1、2、4、8、16 个线程共享同一个 PayJS 实例调用 check_status，输出各线程数下的吞吐量，
+并校验每个返回都对应自己的请求（没有串号）
+
+用法：python benchmarks/stress_threads.py [--requests 400] [--latency 0.005] [--threads 1,2,4,8,16]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payjs import PayJS  # noqa: E402
+from payjs.sign import get_signature  # noqa: E402
+
+MCHID = 'bench-mchid'
+KEY = 'bench-key'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    模拟 /api/check：原样返回请求中的 payjs_order_id，并附上正确的签名
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = dict(parse_qsl(self.rfile.read(length).decode()))
+        time.sleep(self.latency)
+
+        body = {
+            'return_code': 1,
+            'mchid': MCHID,
+            'payjs_order_id': data.get('payjs_order_id'),
+            'out_trade_no': 'out-' + data.get('payjs_order_id', ''),
+            'status': 1,
+        }
+        body['sign'] = get_signature(KEY, body)
+        content = json.dumps(body).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(latency):
+    handler = type('Handler', (StandInHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(client, threads, total):
+    def call(i):
+        payjs_order_id = 'bench{}'.format(i)
+        r = client.check_status(payjs_order_id=payjs_order_id)
+        return bool(r) and r.paid and r.payjs_order_id == payjs_order_id
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        ok = list(executor.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, ok.count(False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400, help='每个线程数下的总请求数')
+    parser.add_argument('--latency', type=float, default=0.005, help='模拟服务的延迟（秒）')
+    parser.add_argument('--threads', default='1,2,4,8,16', help='逗号分隔的线程数')
+    args = parser.parse_args()
+
+    server = start_stand_in(args.latency)
+    host, port = server.server_address
+    client = PayJS(MCHID, KEY, API_BASE='http://{}:{}/api'.format(host, port))
+
+    run(client, 1, 10)  # 预热连接
+
+    failed = 0
+    baseline = None
+    print('{:>8} {:>12} {:>8} {:>8}'.format('threads', 'req/s', 'speedup', 'errors'))
+    for threads in [int(x) for x in args.threads.split(',')]:
+        throughput, errors = run(client, threads, args.requests)
+        baseline = baseline or throughput
+        failed += errors
+        print('{:>8} {:>12.1f} {:>7.2f}x {:>8}'.format(threads, throughput, throughput / baseline, errors))
+
+    server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
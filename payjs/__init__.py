@@ -1,5 +1,7 @@
 from payjs.base import PayJS
 from payjs.notify import PayJSNotify
+from payjs.journal import OrderJournal
+from payjs.tracker import OrderTracker
 
 Payjs = PayJS
 payjs = PayJS
@@ -1,14 +1,26 @@
+import asyncio
+import functools
+import heapq
+import itertools
 import json
 import logging
+import socket
+import threading
+import time
 import requests
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlencode
 
 from payjs.result import PayJSResultSuccess, PayJSResultFail
 from payjs.sign import get_signature, check_signature
+from payjs.tracker import PAID
 from payjs.utils import check_url
-from payjs.exceptions import InvalidSignatureException, InvalidInfoException
+from payjs.exceptions import PayJSException, InvalidSignatureException, InvalidInfoException, \
+    DeadlineExceededException
 
 logger = logging.getLogger(__name__)
 
@@ -17,23 +29,52 @@ class PayJS:
     """
     PayJS
     用于 payjs.cn 的 API
+
+    实例是线程安全的：配置在初始化后不可修改，请求不会修改调用方传入的参数，每次调用的状态都保存在调用内部，
+    因此可以在多个线程（或协程的线程池）中共享同一个实例，并复用其中的空闲连接
     """
 
+    API_BASE = 'https://payjs.cn/api'  # 接口地址前缀
+    POOL_SIZE = 32  # 最多保留的空闲连接数，应不小于共享实例的线程数
+
     FORCE_SSL = True
 
-    payjs_order_id = ''
+    MICROPAY_POLL_SCHEDULE = (0.5, 0.5, 1, 1, 2, 2, 3, 5)  # 刷卡支付等待时的查询间隔（秒），最后一项会一直重复
+    MICROPAY_WAIT_TIMEOUT = 60  # 刷卡支付默认最长等待时间（秒）
+    MICROPAY_CLOSE_TIMEOUT = 10  # 停止等待刷卡支付时，关闭订单与再次查询各自的时限（秒）
+    MICROPAY_TRACKER_INTERVAL = 0.1  # 设置了 tracker 时，等待刷卡支付期间检查订单是否已支付的间隔（秒）
+
+    TIMEOUT = None  # 每次调用默认的总时限（秒），从签名完成到读完返回内容（含对冲请求），None 为不限制
+    HEDGE_PERCENTILE = None  # 幂等接口（查询、关闭订单）的对冲请求阈值百分位（如 95），None 为不发送对冲请求
+    HEDGE_DELAY = 1.0  # 延迟样本不足时发送对冲请求前的等待时间（秒）
+    HEDGE_MIN_SAMPLES = 20  # 使用百分位计算对冲阈值所需的最少延迟样本数
+    HEDGE_WINDOW = 200  # 每个接口保留的最近延迟样本数
+    HEDGE_TIMEOUT = 10  # 未设置时限时，开启对冲的请求使用的时限（秒）
+
+    CONFIG = (
+        'API_BASE', 'POOL_SIZE', 'FORCE_SSL', 'MICROPAY_POLL_SCHEDULE', 'MICROPAY_WAIT_TIMEOUT',
+        'MICROPAY_CLOSE_TIMEOUT', 'MICROPAY_TRACKER_INTERVAL', 'TIMEOUT', 'HEDGE_PERCENTILE', 'HEDGE_DELAY', 'HEDGE_MIN_SAMPLES', 'HEDGE_WINDOW', 'HEDGE_TIMEOUT',
+    )  # 可以在初始化时通过关键字参数覆盖的配置项
 
-    def __init__(self, mchid: str, key: str, notify_url=None, **kwargs):
+    def __init__(self, mchid: str, key: str, notify_url=None, journal=None, tracker=None, **kwargs):
         """
         初始化
 
         :param mchid: 商户号
         :param key: 密钥
         :param notify_url: （可选）异步通知的 URL，留空为不通知或在发起请求时设置
+        :param journal: （可选）OrderJournal，设置后会在发送前记录每一笔请求，收到返回后再记录返回
+        :param tracker: （可选）OrderTracker，设置后会汇总每一笔请求的返回
         :param FORCE_SSL: （默认为 True）回调地址强制使用 HTTPS
+        :param TIMEOUT: （默认为 None）每次调用默认的总时限（秒）
+        :param HEDGE_PERCENTILE: （默认为 None）开启对冲请求时的延迟百分位阈值
+
+        其余配置项见 CONFIG，传入未知的配置项会抛出 InvalidInfoException
         """
 
         for k, v in kwargs.items():
+            if k not in self.CONFIG:
+                raise InvalidInfoException(-2006, '未知的配置项 {}'.format(k))
             self.__setattr__(k, v)
 
         if type(mchid) is not str:
@@ -50,28 +91,172 @@ class PayJS:
             raise InvalidInfoException(-2003, "通知回调网址错误")
 
         self.notify_url = notify_url
+        self.journal = journal
+        self.tracker = tracker
+
+        self._channels = []  # 空闲的 _Channel
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2 * self.POOL_SIZE)  # 发送对冲请求中的各个请求
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('PayJS 实例的配置不可修改，请使用新的配置创建实例')
+        super().__setattr__(name, value)
 
-    def request(self, url: str, data: dict, method='POST'):
+    def __delattr__(self, name):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('PayJS 实例的配置不可修改，请使用新的配置创建实例')
+        super().__delattr__(name)
+
+    def request(self, url: str, data: dict, method='POST', timeout=None, hedge=False):
         """
         处理请求（请求时会过滤值为空的参数）
 
         :param url: 请求的 url
-        :param data: 请求的参数字典（不包含签名）
+        :param data: 请求的参数字典（不包含签名，不会被修改）
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT，超时抛出 DeadlineExceededException
+        :param hedge: （默认为 False）是否允许发送对冲请求（仅应对幂等接口开启）
         :return: 返回一个 PayJSResultSuccess 或 PayJSResultFail 类元素
         """
-        data['sign'] = get_signature(self.key, data)
+        if timeout is None:
+            timeout = self.TIMEOUT
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        sign = get_signature(self.key, data)
         data = {k: v for k, v in data.items() if v}
-        if method == 'GET':
-            r = requests.get(url, params=data, allow_redirects=False)
+        data['sign'] = sign
+        _remaining(deadline)
+
+        api = url.rsplit('/', 1)[-1]
+        if self.journal is not None:
+            self.journal.record_intent(api, data)
+
+        if hedge and self.HEDGE_PERCENTILE:
+            r = self._hedged_send(method, url, data, deadline)
         else:
-            r = requests.post(url, data=data, allow_redirects=False)
+            r = self._send(method, url, data, deadline)
 
-        return self.parse_response(r)
+        ret = self.parse_response(r, api=api)
+        if self.journal is not None:
+            self.journal.record_request(api, data, ret)
+        if self.tracker is not None:
+            self.tracker.ingest_result(ret)
+        return ret
 
-    def parse_response(self, raw_response: requests.Response):
+    def _send(self, method, url, data, deadline, race=None):
+        """
+        在一个独占的连接上发送一次请求
+
+        连接与读取的超时均为剩余的时限，到达时限时由 _watchdog 直接关闭连接，因此缓慢返回的内容也不会超过时限
+        """
+        remaining = _remaining(deadline)
+        channel = self._acquire_channel()
+        lease = channel.lease
+        if race is not None and not race.join(channel, lease):
+            self._release_channel(channel)
+            raise DeadlineExceededException(-4002, 'Hedged request cancelled')
+
+        timer = None
+        if deadline is not None:
+            timer = _watchdog.schedule(deadline, functools.partial(channel.abort, lease, deadline=True))
+
+        start = time.monotonic()
+        r = None
+        try:
+            r = channel.send(method, url, data, timeout=remaining)
+        except (requests.RequestException, OSError) as e:
+            if channel.deadline_exceeded or (deadline is not None and deadline <= time.monotonic()):
+                raise DeadlineExceededException() from e
+            raise
+        finally:
+            if timer is not None:
+                _watchdog.cancel(timer)
+            if race is not None:
+                race.leave(channel, lease)
+            if r is not None or channel.aborted:
+                # 被关闭（超时或对冲落败）的请求也记录已用时间，作为其延迟的下限，以免百分位只来自较快的请求
+                self._record_latency(url, time.monotonic() - start)
+            self._release_channel(channel)
+        return r
+
+    def _record_latency(self, url, latency):
+        with self._lock:
+            samples = self._latencies.get(url)
+            if samples is None:
+                samples = self._latencies[url] = deque(maxlen=self.HEDGE_WINDOW)
+            samples.append(latency)
+
+    def _acquire_channel(self):
+        with self._lock:
+            channel = self._channels.pop() if self._channels else None
+        if channel is None:
+            channel = _Channel()
+        channel.begin()
+        return channel
+
+    def _release_channel(self, channel):
+        if channel.end():
+            with self._lock:
+                if len(self._channels) < self.POOL_SIZE:
+                    self._channels.append(channel)
+                    return
+        channel.close()
+
+    def _hedged_send(self, method, url, data, deadline):
+        """
+        发送对冲请求：首个请求超过延迟百分位仍未返回（或很快失败）时再发送一个，取先成功返回的结果并关闭另一个请求的连接
+
+        各个请求都在 _executor 中发送，调用方只等待 race.done，因此卡在建立连接等无法中断的阶段的请求不会拖住调用方；
+        未设置时限时使用 HEDGE_TIMEOUT，保证落败的请求不会一直占用线程与连接
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(url, ()))
+
+        if len(samples) >= self.HEDGE_MIN_SAMPLES:
+            delay = samples[min(len(samples) - 1, int(len(samples) * self.HEDGE_PERCENTILE / 100))]
+        else:
+            delay = self.HEDGE_DELAY
+
+        if deadline is None:
+            deadline = time.monotonic() + self.HEDGE_TIMEOUT
+
+        race = _Race()
+        launch = functools.partial(self._executor.submit, self._race_attempt, race, method, url, data, deadline)
+        launch()
+        timer = _watchdog.schedule(time.monotonic() + delay, launch)
+
+        done = race.done.wait(max(deadline - time.monotonic(), 0))
+        _watchdog.cancel(timer)
+        if not done:
+            race.abort_all()
+            raise DeadlineExceededException()
+        if race.winner is not None:
+            return race.winner
+        raise race.error
+
+    def _race_attempt(self, race, method, url, data, deadline):
+        if not race.start():
+            return
+        if race.started > 1:
+            logger.debug('对 {} 发送对冲请求'.format(url))
+
+        try:
+            r = self._send(method, url, data, deadline, race=race)
+        except (PayJSException, requests.RequestException, OSError) as e:
+            if race.finish(error=e):
+                # 首个请求很快失败且尚未发送对冲请求，立即重试一次
+                self._race_attempt(race, method, url, data, deadline)
+        else:
+            race.finish(response=r)
+
+    def parse_response(self, raw_response: requests.Response, api: str = None):
         """
         处理请求，将 requests 的返回包装为 PayJSResult
         :param raw_response: requests 的返回值
+        :param api: （可选）接口名（如 check），省略时取请求网址的最后一段
         :return: 一个 PayJSResult 元素（Success 或 Fail）
         """
         if raw_response.status_code == 200:
@@ -79,59 +264,58 @@ class PayJS:
             try:
                 j = json.loads(raw_response.content)
             except json.JSONDecodeError:
-                return PayJSResultFail(raw_response=raw_response, r_json=False)
+                return PayJSResultFail(raw_response=raw_response, r_json=False, api=api)
             except UnicodeDecodeError:
-                return PayJSResultFail(raw_response=raw_response, r_json=False)
+                return PayJSResultFail(raw_response=raw_response, r_json=False, api=api)
 
             try:
                 check_signature(self.key, j)
             except InvalidSignatureException:
-                response = PayJSResultFail(raw_response=raw_response, r_json=j)
+                response = PayJSResultFail(raw_response=raw_response, r_json=j, api=api)
                 response.error_msg = '返回的签名错误'
 
             if str(j.get('return_code')) == '0':  # 请求失败
-                response = PayJSResultFail(raw_response=raw_response, r_json=j)
+                response = PayJSResultFail(raw_response=raw_response, r_json=j, api=api)
             else:
-                response = PayJSResultSuccess(raw_response=raw_response, r_json=j)
+                response = PayJSResultSuccess(raw_response=raw_response, r_json=j, api=api)
 
         elif raw_response.status_code == 302:
             # 收银台支付
-            return PayJSResultSuccess(raw_response=raw_response, r_json=None)
+            return PayJSResultSuccess(raw_response=raw_response, r_json=None, api=api)
         else:
-            response = PayJSResultFail(raw_response=raw_response, r_json=False)
+            response = PayJSResultFail(raw_response=raw_response, r_json=False, api=api)
         return response
 
-    def check_status_by_payjs_order_id(self, payjs_order_id=None):
+    def check_status_by_payjs_order_id(self, payjs_order_id=None, timeout=None):
         """
         通过 PayJS 订单号来查询交易状态
         :param payjs_order_id: PayJS 订单号
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return: 返回一个 PayJSResult 成员，当其为 SUCCESS 时存在一个 PAID 属性来表明是否已支付
         """
         if not payjs_order_id:
-            payjs_order_id = self.payjs_order_id
-            if not payjs_order_id:
-                raise InvalidInfoException(-3001, '无效的订单号（目前仅支持 PayJS 订单号查询）')
+            raise InvalidInfoException(-3001, '无效的订单号（目前仅支持 PayJS 订单号查询）')
 
         payjs_order_id = str(payjs_order_id)
 
         if not 1 <= len(payjs_order_id) <= 32:
             logger.warning('订单号位数可能错误（需要在 1 - 32 位）')
 
-        url = r'https://payjs.cn/api/check'
+        url = self.API_BASE + '/check'
 
         data = {
             'payjs_order_id': payjs_order_id,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout, hedge=True)
 
         # return self.request(url, data)
         return ret
 
-    def check_status(self, *, payjs_order_id=None):
-        return self.check_status_by_payjs_order_id(payjs_order_id)
+    def check_status(self, *, payjs_order_id=None, timeout=None):
+        return self.check_status_by_payjs_order_id(payjs_order_id, timeout=timeout)
 
-    def native(self, total_fee: int, out_trade_no, body: str = '', notify_url=None, attach=None):
+    def native(self, total_fee: int, out_trade_no, body: str = '', notify_url=None, attach=None, timeout=None):
         """
         发起扫码支付
         :param total_fee: 支付金额，单位为分，介于 1 - 1000000 之间
@@ -139,9 +323,10 @@ class PayJS:
         :param body: （可选）订单标题，0 - 32 字符
         :param notify_url: （可选）回调地址，留空使用默认，传入空字符串代表无需回调
         :param attach: （可选）用户自定义数据，在notify的时候会原样返回
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return:
         """
-        url = r'https://payjs.cn/api/native'
+        url = self.API_BASE + '/native'
 
         if not total_fee > 0:
             raise InvalidInfoException(-2004, "金额必须为正整数（单位为分）")
@@ -170,7 +355,7 @@ class PayJS:
             'attach': attach,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout)
         return ret
 
     def cashier(self, total_fee: int, out_trade_no, body: str = '', notify_url=None, callback_url=None, attach=None):
@@ -188,7 +373,7 @@ class PayJS:
         raise NotImplementedError('cashier 接口暂不可用，请参考文档改为调用 get_cashier_url 接口')
 
         logger.warning('此接口目前情况下使用会出问题，请使用 get_cashier_url 直接获取构造出的跳转网址')
-        url = r'https://payjs.cn/api/cashier'
+        url = self.API_BASE + '/cashier'
 
         if not total_fee > 0:
             raise InvalidInfoException(-2004, "金额必须为正整数（单位为分）")
@@ -241,7 +426,7 @@ class PayJS:
         :param hide: （可选）设置为 True 会隐藏界面样式
         :return: PayJSResult
         """
-        url = r'https://payjs.cn/api/cashier'
+        url = self.API_BASE + '/cashier'
 
         if not total_fee > 0:
             raise InvalidInfoException(-2004, "金额必须为正整数（单位为分）")
@@ -281,7 +466,8 @@ class PayJS:
 
         return url + '?' + urlencode(data)
 
-    def jsapi(self, total_fee: int, out_trade_no, openid, body: str = '', notify_url=None, attach=None):
+    def jsapi(self, total_fee: int, out_trade_no, openid, body: str = '', notify_url=None, attach=None,
+              timeout=None):
         """
         发起 JSAPI 支付
         :param total_fee: 支付金额，单位为分，介于 1 - 1000000 之间
@@ -290,9 +476,10 @@ class PayJS:
         :param body: （可选）订单标题，0 - 32 字符
         :param notify_url: （可选）回调地址，留空使用默认，传入空字符串代表无需回调
         :param attach: （可选）用户自定义数据，在notify的时候会原样返回
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return:
         """
-        url = r'https://payjs.cn/api/jsapi'
+        url = self.API_BASE + '/jsapi'
 
         if not total_fee > 0:
             raise InvalidInfoException(-2004, "金额必须为正整数（单位为分）")
@@ -322,19 +509,20 @@ class PayJS:
             'openid': openid,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout)
         return ret
 
-    def micropay(self, total_fee: int, out_trade_no, auth_code, body: str = ''):
+    def micropay(self, total_fee: int, out_trade_no, auth_code, body: str = '', timeout=None):
         """
         发起刷卡支付
         :param total_fee: 支付金额，单位为分，介于 1 - 1000000 之间
         :param out_trade_no: 订单号，应保证唯一性，1-32 字符
         :param auth_code: 刷卡支付授权码，设备读取用户微信中的条码或者二维码信息，18 位纯数字，以 10、11、12、13、14、15 开头
         :param body: （可选）订单标题，0 - 32 字符
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return:
         """
-        url = r'https://payjs.cn/api/micropay'
+        url = self.API_BASE + '/micropay'
 
         if not total_fee > 0:
             raise InvalidInfoException(-2004, "金额必须为正整数（单位为分）")
@@ -360,59 +548,252 @@ class PayJS:
             'auth_code': auth_code,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout)
         return ret
 
-    def close(self, payjs_order_id=None):
+    def micropay_and_wait(self, total_fee: int, out_trade_no, auth_code, body: str = '', timeout=None,
+                          schedule=None, cancel_event=None):
+        """
+        发起刷卡支付并等待支付结果
+
+        用户需要输入密码时 micropay 会在支付完成前返回，此时会按照 schedule 先密后疏地查询订单状态，
+        直到订单已支付或超过 timeout；超时或被取消时会自动关闭订单
+        设置了 tracker 时，tracker 中的订单变为已支付（如先收到了异步通知）会结束当前的等待并立即查询确认
+
+        :param total_fee: 支付金额，单位为分，介于 1 - 1000000 之间
+        :param out_trade_no: 订单号，应保证唯一性，1-32 字符
+        :param auth_code: 刷卡支付授权码，18 位纯数字
+        :param body: （可选）订单标题，0 - 32 字符
+        :param timeout: （可选）从发起支付开始计算的最长等待时间（秒），默认为 MICROPAY_WAIT_TIMEOUT
+        :param schedule: （可选）查询间隔序列（秒），最后一项会一直重复，默认为 MICROPAY_POLL_SCHEDULE
+        :param cancel_event: （可选）threading.Event，被 set 后停止等待并关闭订单
+        :return: 直接支付成功或未能获得 PayJS 订单号时返回 micropay 的结果，否则返回最后一次订单查询的 PayJSResult，
+                 额外带有 wait_time（确认用时，秒）、check_count（查询次数）、timeout（是否超时）、
+                 cancelled（是否被取消）与 close_result（关闭订单的结果，未关闭为 None）属性
+        """
+        start = time.monotonic()
+        deadline = start + (self.MICROPAY_WAIT_TIMEOUT if timeout is None else timeout)
+
+        ret = self.micropay(total_fee, out_trade_no, auth_code, body=body, timeout=self._check_timeout(deadline))
+        if ret:
+            return _finish_micropay_wait(ret, start, 0)
+        payjs_order_id = _get_payjs_order_id(ret)
+        if not payjs_order_id:
+            return ret
+
+        status = ret
+        check_count = 0
+        woken = False
+        for interval in _poll_intervals(schedule or self.MICROPAY_POLL_SCHEDULE):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            woken = self._micropay_sleep(payjs_order_id, min(interval, remaining), cancel_event, watch=not woken)
+            if cancel_event is not None and cancel_event.is_set():
+                status, close_result = self._abort_micropay_wait(payjs_order_id, status)
+                return _finish_micropay_wait(status, start, check_count + 1, cancelled=True,
+                                             close_result=close_result)
+
+            check_count += 1
+            try:
+                status = self.check_status(payjs_order_id=payjs_order_id, timeout=self._check_timeout(deadline))
+            except (DeadlineExceededException, requests.RequestException) as e:
+                logger.warning('刷卡支付 {} 查询失败：{!r}'.format(payjs_order_id, e))
+                continue
+            if status and status.paid:
+                return _finish_micropay_wait(status, start, check_count)
+
+        status, close_result = self._abort_micropay_wait(payjs_order_id, status)
+        return _finish_micropay_wait(status, start, check_count + 1, timeout=True, close_result=close_result)
+
+    async def micropay_and_wait_async(self, total_fee: int, out_trade_no, auth_code, body: str = '', timeout=None,
+                                      schedule=None):
+        """
+        micropay_and_wait 的 asyncio 版本，请求会在默认线程池中执行
+
+        取消所在的 Task 即可停止等待，取消时会先关闭订单再抛出 CancelledError
+
+        :return: 同 micropay_and_wait
+        """
+        loop = asyncio.get_event_loop()
+
+        def call(func, *args, **kwargs):
+            return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+        start = time.monotonic()
+        deadline = start + (self.MICROPAY_WAIT_TIMEOUT if timeout is None else timeout)
+
+        micropay = call(self.micropay, total_fee, out_trade_no, auth_code, body=body,
+                        timeout=self._check_timeout(deadline))
+        try:
+            ret = await asyncio.shield(micropay)
+        except asyncio.CancelledError:
+            logger.info('刷卡支付 {} 在下单时被取消，等待下单结果后关闭订单'.format(out_trade_no))
+            await asyncio.shield(self._close_cancelled_micropay(micropay))
+            raise
+        if ret:
+            return _finish_micropay_wait(ret, start, 0)
+        payjs_order_id = _get_payjs_order_id(ret)
+        if not payjs_order_id:
+            return ret
+
+        status = ret
+        check_count = 0
+        woken = False
+        try:
+            for interval in _poll_intervals(schedule or self.MICROPAY_POLL_SCHEDULE):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                woken = await self._micropay_sleep_async(payjs_order_id, min(interval, remaining), watch=not woken)
+
+                check_count += 1
+                try:
+                    status = await call(self.check_status, payjs_order_id=payjs_order_id,
+                                        timeout=self._check_timeout(deadline))
+                except (DeadlineExceededException, requests.RequestException) as e:
+                    logger.warning('刷卡支付 {} 查询失败：{!r}'.format(payjs_order_id, e))
+                    continue
+                if status and status.paid:
+                    return _finish_micropay_wait(status, start, check_count)
+        except asyncio.CancelledError:
+            logger.info('刷卡支付 {} 等待被取消，关闭订单'.format(payjs_order_id))
+            await asyncio.shield(call(self._abort_micropay_wait, payjs_order_id, status))
+            raise
+
+        status, close_result = await call(self._abort_micropay_wait, payjs_order_id, status)
+        return _finish_micropay_wait(status, start, check_count + 1, timeout=True, close_result=close_result)
+
+    async def _close_cancelled_micropay(self, micropay):
+        """
+        micropay_and_wait_async 在下单时被取消：等待下单结果，关闭已创建但尚未支付的订单
+        """
+        try:
+            ret = await micropay
+        except (PayJSException, requests.RequestException) as e:
+            logger.warning('被取消的刷卡支付下单失败：{!r}'.format(e))
+            return
+        payjs_order_id = _get_payjs_order_id(ret)
+        if payjs_order_id and not ret:
+            await asyncio.get_event_loop().run_in_executor(None, self._abort_micropay_wait, payjs_order_id, ret)
+
+    def _micropay_sleep(self, payjs_order_id, seconds, cancel_event=None, watch=True):
+        """
+        等待一个查询间隔，cancel_event 被 set 时提前结束
+        watch 为 True 且设置了 tracker 时，每隔 MICROPAY_TRACKER_INTERVAL 检查一次 tracker，订单已支付时也提前结束
+
+        :return: 是否因 tracker 中的订单已支付而提前结束
+        """
+        end = time.monotonic() + seconds
+        watch = watch and self.tracker is not None
+        while True:
+            if watch and self._tracked_paid(payjs_order_id):
+                return True
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            step = min(remaining, self.MICROPAY_TRACKER_INTERVAL) if watch else remaining
+            if cancel_event is None:
+                time.sleep(step)
+            elif cancel_event.wait(step):
+                return False
+
+    async def _micropay_sleep_async(self, payjs_order_id, seconds, watch=True):
+        """
+        _micropay_sleep 的 asyncio 版本
+        """
+        end = time.monotonic() + seconds
+        watch = watch and self.tracker is not None
+        while True:
+            if watch and self._tracked_paid(payjs_order_id):
+                return True
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(remaining, self.MICROPAY_TRACKER_INTERVAL) if watch else remaining)
+
+    def _tracked_paid(self, payjs_order_id):
+        record = self.tracker.get(payjs_order_id=payjs_order_id)
+        return record is not None and record.state == PAID
+
+    def _check_timeout(self, deadline):
+        """
+        等待刷卡支付时单次查询的时限：不超过等待的总时限，但至少留出 1 秒以便最后一次查询能完成
+        """
+        timeout = max(deadline - time.monotonic(), 1)
+        return timeout if self.TIMEOUT is None else min(timeout, self.TIMEOUT)
+
+    def _abort_micropay_wait(self, payjs_order_id, status):
+        """
+        停止等待刷卡支付：关闭订单，再查询一次以免错过刚完成的支付
+
+        两次请求各自以 MICROPAY_CLOSE_TIMEOUT 为时限，请求出错时只记录日志，保留已有的结果
+
+        :return: (最终的订单查询结果, 关闭订单的结果，关闭请求出错时为 None)
+        """
+        close_result = None
+        try:
+            close_result = self.close(payjs_order_id, timeout=self.MICROPAY_CLOSE_TIMEOUT)
+        except (DeadlineExceededException, requests.RequestException) as e:
+            logger.warning('刷卡支付 {} 关闭失败：{!r}'.format(payjs_order_id, e))
+        else:
+            if not close_result:
+                logger.warning('刷卡支付 {} 关闭失败：{}'.format(payjs_order_id, close_result.error_msg))
+
+        try:
+            status = self.check_status(payjs_order_id=payjs_order_id, timeout=self.MICROPAY_CLOSE_TIMEOUT)
+        except (DeadlineExceededException, requests.RequestException) as e:
+            logger.warning('刷卡支付 {} 查询失败：{!r}'.format(payjs_order_id, e))
+        return status, close_result
+
+    def close(self, payjs_order_id=None, timeout=None):
         """
         通过 PayJS 订单号来查询交易状态
         :param payjs_order_id: PayJS 订单号
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return: 返回一个 PayJSResult 成员，当其为 SUCCESS 时存在一个 PAID 属性来表明是否已支付
         """
         if not payjs_order_id:
-            payjs_order_id = self.payjs_order_id
-            if not payjs_order_id:
-                raise InvalidInfoException(-2005, '未提供订单号')
+            raise InvalidInfoException(-2005, '未提供订单号')
 
         payjs_order_id = str(payjs_order_id)
 
         if not 1 <= len(payjs_order_id) <= 32:
             logger.warning('订单号可能错误（位数需要在 1 - 32 位）')
 
-        url = r'https://payjs.cn/api/close'
+        url = self.API_BASE + '/close'
 
         data = {
             'payjs_order_id': payjs_order_id,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout, hedge=True)
 
         # return self.request(url, data)
         return ret
 
-    def refund(self, payjs_order_id=None):
+    def refund(self, payjs_order_id=None, timeout=None):
         """
         通过 PayJS 订单号退款
         :param payjs_order_id: PayJS 订单号
+        :param timeout: （可选）本次调用的总时限（秒），默认为 TIMEOUT
         :return: 返回一个 PayJSResult 成员，当其为 SUCCESS 时存在一个 PAID 属性来表明是否已支付
         """
         if not payjs_order_id:
-            payjs_order_id = self.payjs_order_id
-            if not payjs_order_id:
-                raise InvalidInfoException(-2005, '未提供订单号')
+            raise InvalidInfoException(-2005, '未提供订单号')
 
         payjs_order_id = str(payjs_order_id)
 
         if not 1 <= len(payjs_order_id) <= 32:
             logger.warning('订单号可能错误（位数需要在 1 - 32 位）')
 
-        url = r'https://payjs.cn/api/refund'
+        url = self.API_BASE + '/refund'
 
         data = {
             'payjs_order_id': payjs_order_id,
         }
 
-        ret = self.request(url, data)
+        ret = self.request(url, data, timeout=timeout)
 
         return ret
 
@@ -425,7 +806,7 @@ class PayJS:
         :param callback_url: 支付成功后前端跳转地址
         :return: PayJSResult
         """
-        url = r'https://payjs.cn/api/openid'
+        url = self.API_BASE + '/openid'
 
         if not check_url(callback_url, force_ssl=self.FORCE_SSL):
             raise InvalidInfoException(-2004, '前端跳转地址有误')
@@ -444,3 +825,263 @@ class PayJS:
     JSApiPay = jsapi
     MicroPay = micropay
     cashier_legacy = get_cashier_url
+
+
+def _remaining(deadline):
+    """
+    计算距离时限的剩余时间，已超时则抛出 DeadlineExceededException
+
+    :param deadline: time.monotonic() 下的时限，None 为不限制
+    :return: 剩余秒数或 None
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededException()
+    return remaining
+
+
+class _TrackingAdapter(HTTPAdapter):
+    """
+    只保留一个连接的 HTTPAdapter，记录当前使用的连接，以便在其他线程中关闭
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        super().__init__(pool_connections=1, pool_maxsize=1)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        channel = self.channel
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            conn_cls = pool_cls.ConnectionCls
+
+            def connect(conn, _connect=conn_cls.connect):
+                channel.connection = conn
+                if channel.aborted:
+                    raise ConnectionAbortedError('请求已被取消')
+                _connect(conn)
+                if channel.aborted:
+                    conn.close()
+                    raise ConnectionAbortedError('请求已被取消')
+
+            tracked = type(conn_cls.__name__, (conn_cls,), {'connect': connect})
+            pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': tracked})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+
+class _Channel:
+    """
+    同一时刻只被一个请求使用的 Session（保持一个长连接），可以从其他线程中强制关闭正在进行的请求
+
+    每次取出使用时 lease 加一，abort 只对仍在进行中的同一次使用生效，
+    因此迟到的关闭（如已触发的超时回调、对冲中的另一方）不会影响已放回或已被其他请求取出的连接
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self.deadline_exceeded = False
+        self.connection = None
+        self.lease = 0
+        self.active = False
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = _TrackingAdapter(self)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def begin(self):
+        with self.lock:
+            self.lease += 1
+            self.active = True
+
+    def end(self):
+        """
+        结束本次使用，之后的 abort 不再生效
+
+        :return: 是否可以复用（未被关闭）
+        """
+        with self.lock:
+            self.active = False
+            return not self.aborted
+
+    def send(self, method, url, data, timeout):
+        if method == 'GET':
+            return self.session.get(url, params=data, allow_redirects=False, timeout=timeout)
+        return self.session.post(url, data=data, allow_redirects=False, timeout=timeout)
+
+    def abort(self, lease, deadline=False):
+        """
+        关闭第 lease 次使用中的连接，正在阻塞读写的请求会立即失败；关闭后的 _Channel 不再复用
+        """
+        with self.lock:
+            if lease != self.lease or not self.active:
+                return
+            self.deadline_exceeded = self.deadline_exceeded or deadline
+            self.aborted = True
+            sock = getattr(self.connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.session.close()
+
+
+class _Race:
+    """
+    一次对冲请求中各个请求之间的协调状态，最多发出两个请求（对冲请求或快速失败后的重试）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.channels = []
+        self.started = 0
+        self.finished = 0
+        self.closed = False
+        self.winner = None
+        self.error = None
+
+    def start(self):
+        """
+        登记一个新的请求；已有结果、调用方已不再等待或已发出两个请求时返回 False
+        """
+        with self.lock:
+            if self.winner is not None or self.closed or self.started >= 2:
+                return False
+            self.started += 1
+            return True
+
+    def join(self, channel, lease):
+        with self.lock:
+            if self.winner is not None or self.closed:
+                return False
+            self.channels.append((channel, lease))
+            return True
+
+    def leave(self, channel, lease):
+        with self.lock:
+            self.channels.remove((channel, lease))
+
+    def finish(self, response=None, error=None):
+        """
+        :return: 是否需要立即重试（首个请求已失败且对冲请求尚未发出）
+        """
+        with self.lock:
+            self.finished += 1
+            if response is not None and self.winner is None:
+                self.winner = response
+                self._abort_channels()
+            elif error is not None:
+                self.error = error
+                if self.winner is None and self.started == 1 and not self.closed:
+                    return True
+            if self.winner is not None or self.finished == self.started:
+                self.done.set()
+            return False
+
+    def abort_all(self):
+        with self.lock:
+            self.closed = True
+            self._abort_channels()
+
+    def _abort_channels(self):
+        # 持有 self.lock 时调用，保证关闭时各请求尚未离开 race
+        for channel, lease in self.channels:
+            channel.abort(lease)
+
+
+class _Watchdog:
+    """
+    所有 PayJS 实例共享的定时线程，按时间先后执行登记的回调（关闭到达时限的连接、发出对冲请求）
+
+    回调应很快返回；取消只是将回调置空，到期时直接丢弃
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread = None
+
+    def schedule(self, when, callback):
+        """
+        在 time.monotonic() 到达 when 时执行 callback
+
+        :return: 用于 cancel 的句柄
+        """
+        entry = [when, next(self._seq), callback]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='payjs-watchdog', daemon=True)
+                self._thread.start()
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self._cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        callback = heapq.heappop(self._heap)[2]
+                        break
+                    self._cond.wait(delay)
+            try:
+                callback()
+            except Exception:
+                logger.exception('定时回调出错')
+
+
+_watchdog = _Watchdog()
+
+
+def _get_payjs_order_id(result):
+    """
+    从下单结果中取得 PayJS 订单号（刷卡支付需要用户输入密码时下单结果可能为失败但仍带有订单号）
+    """
+    payjs_order_id = getattr(result, 'payjs_order_id', None)
+    if not payjs_order_id and type(result.json) is dict:
+        payjs_order_id = result.json.get('payjs_order_id')
+    return payjs_order_id
+
+
+def _poll_intervals(schedule):
+    """
+    依次产出 schedule 中的间隔，之后一直重复最后一项
+    """
+    yield from schedule
+    while True:
+        yield schedule[-1]
+
+
+def _finish_micropay_wait(status, start, check_count, timeout=False, cancelled=False, close_result=None):
+    """
+    为刷卡支付的最终查询结果附加等待相关的指标
+    """
+    status.wait_time = time.monotonic() - start
+    status.check_count = check_count
+    status.timeout = timeout
+    status.cancelled = cancelled
+    status.close_result = close_result
+
+    logger.info('刷卡支付 {} 等待结束：paid={} wait_time={:.3f}s check_count={} timeout={} cancelled={}'.format(
+        getattr(status, 'payjs_order_id', ''), bool(status and status.paid), status.wait_time, check_count,
+        timeout, cancelled))
+    return status
@@ -31,3 +31,8 @@ class InvalidSignatureException(PayJSException):
 class InvalidInfoException(PayJSException):
     def __init__(self, code=-2000, msg='Invalid info'):
         super().__init__(code, msg)
+
+
+class DeadlineExceededException(PayJSException):
+    def __init__(self, code=-4001, msg='Deadline exceeded'):
+        super().__init__(code, msg)
@@ -0,0 +1,589 @@
+import bisect
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from payjs.exceptions import InvalidInfoException
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = 'seg-{:08d}.jsonl'
+SEGMENT_PATTERN = re.compile(r'^seg-(\d{8})\.jsonl$')
+INDEX_NAME = 'index.idx'
+PENDING_NAME = 'pending.json'
+
+INDEX_MAGIC = b'PJSIDX2\0'
+INDEX_HEADER = struct.Struct('<8sQI')  # magic, 已封存（已建立索引）的最大段号, 段表的条目数
+INDEX_SEGMENT = struct.Struct('<IQ')  # 段表：段号、建立索引时的段大小（用于发现压缩中途崩溃等与段不一致的索引）
+INDEX_ENTRY = struct.Struct('<c32sIQ')  # 字段（o: out_trade_no, p: payjs_order_id）、键、段号、偏移
+INDEX_KEY_SIZE = 33
+
+FIELDS = {'out_trade_no': b'o', 'payjs_order_id': b'p'}
+
+CREATE_APIS = ('native', 'jsapi', 'micropay')
+
+
+def _index_key(field, value):
+    """
+    索引中的定长键，超过 32 字节的值会被截断（读取记录后会再次比对）
+    """
+    return FIELDS[field] + str(value).encode()[:32].ljust(32, b'\0')
+
+
+class _IndexKeys:
+    """
+    将 mmap 中的索引条目包装为只包含键的序列，供 bisect 使用
+    """
+
+    def __init__(self, buf, count, base=INDEX_HEADER.size):
+        self.buf = buf
+        self.count = count
+        self.base = base
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.base + i * INDEX_ENTRY.size
+        return self.buf[start:start + INDEX_KEY_SIZE]
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.buf, self.base + i * INDEX_ENTRY.size)
+
+
+class OrderJournal:
+    """
+    追加写入的订单日志
+
+    以 JSONL 格式记录 PayJS 发起的每一笔请求与每一条异步通知，用于崩溃恢复与对账
+    每笔请求在发送前先追加一条意图（intent）记录，收到返回后再追加一条带返回内容的记录，
+    因此发送后崩溃或超时的下单请求也会出现在 unconfirmed() 中
+    记录按段（segment）存储，当前段写满后封存，封存的段会写入可 mmap 的有序索引（按 out_trade_no 与 payjs_order_id）
+    """
+
+    def __init__(self, path: str, batch_size: int = 1, fsync: bool = True, segment_size: int = 64 * 1024 * 1024,
+                 flush_interval: float = 1.0):
+        """
+        初始化（打开已有的日志时会截掉崩溃时写了一半的记录）
+
+        :param path: 日志目录，不存在时自动创建
+        :param batch_size: （默认为 1）缓冲多少条记录后写入文件，大于 1 时崩溃可能丢失尚未写入的记录
+        :param fsync: （默认为 True）每次写入后是否调用 fsync
+        :param segment_size: （默认为 64 MiB）单个段的最大字节数，超过后自动切换新段
+        :param flush_interval: （默认为 1 秒）batch_size 大于 1 时，缓冲中的记录最多等待多久即写入文件（即使未达到 batch_size），
+                               None 为只在达到 batch_size、flush 或 close 时写入
+        """
+        if batch_size < 1:
+            raise InvalidInfoException(-5001, 'batch_size 必须为正整数')
+        if flush_interval is not None and not flush_interval > 0:
+            raise InvalidInfoException(-5003, 'flush_interval 必须为正数')
+
+        self.path = path
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._live = {}  # 尚未写入索引文件的记录：索引键 -> [(段号, 偏移)]
+        self._pending = {}  # 已发起下单但尚未确认（支付、关闭或下单失败）的订单：out_trade_no -> 摘要
+        self._pending_ids = {}  # payjs_order_id -> out_trade_no
+
+        self._index_file = None
+        self._index_map = None
+        self._index_keys = _IndexKeys(b'', 0)
+        self._index_segments = {}  # 建立索引时各段的大小
+        self._sealed = 0
+
+        os.makedirs(path, exist_ok=True)
+        if not self._open_index():
+            # 除最后一段（当前段）外的段都已封存
+            segments = self._segments()
+            self._sealed = segments[-2] if len(segments) > 1 else 0
+            self._rebuild_index()
+        elif self._index_map is not None and not self._index_matches_segments():
+            logger.warning('索引与日志段不一致（可能在压缩时崩溃），将重建索引')
+            self._rebuild_index()
+        self._recover()
+
+        self._closed = threading.Event()
+        if batch_size > 1 and flush_interval is not None:
+            threading.Thread(target=self._flush_periodically, name='payjs-journal-flush', daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # 写入
+
+    def record_intent(self, api: str, data: dict):
+        """
+        在发送请求前记录请求意图
+
+        :param api: 接口名（如 native、check）
+        :param data: 请求的参数字典
+        """
+        request = {k: v for k, v in data.items() if k != 'sign'}
+        record = {
+            't': time.time(),
+            'kind': 'intent',
+            'api': api,
+            'out_trade_no': request.get('out_trade_no'),
+            'payjs_order_id': request.get('payjs_order_id'),
+            'request': request,
+        }
+        self.append(record)
+
+    def record_request(self, api: str, data: dict, result):
+        """
+        记录一次 API 请求及其返回
+
+        :param api: 接口名（如 native、check）
+        :param data: 请求的参数字典
+        :param result: PayJSResult
+        """
+        request = {k: v for k, v in data.items() if k != 'sign'}
+        response = result.json if type(result.json) is dict else None
+        response = {k: v for k, v in response.items() if k != 'sign'} if response else response
+
+        record = {
+            't': time.time(),
+            'kind': 'request',
+            'api': api,
+            'ok': bool(result),
+            'out_trade_no': request.get('out_trade_no') or (response or {}).get('out_trade_no'),
+            'payjs_order_id': request.get('payjs_order_id') or (response or {}).get('payjs_order_id'),
+            'request': request,
+            'response': response,
+        }
+        self.append(record)
+
+    def record_notify(self, notify):
+        """
+        记录一条已通过签名校验的异步通知
+
+        :param notify: PayJSNotify
+        """
+        record = {
+            't': time.time(),
+            'kind': 'notify',
+            'ok': notify.paid,
+            'out_trade_no': notify.out_trade_no,
+            'payjs_order_id': notify.payjs_order_id,
+            'notify': notify.as_dict(),
+        }
+        self.append(record)
+
+    def append(self, record: dict):
+        """
+        追加一条记录（达到 batch_size 时写入文件）
+        """
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode()
+        with self._lock:
+            self._buffer.append((line, record))
+            if len(self._buffer) >= self.batch_size:
+                self._write_buffer()
+
+    def flush(self):
+        """
+        将缓冲中的记录写入文件
+        """
+        with self._lock:
+            self._write_buffer()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if not self._closed.is_set():
+                    self._write_buffer()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+
+        offset = self._active_size
+        for line, record in self._buffer:
+            self._add_live(record, self._active, offset)
+            self._apply_pending(record)
+            offset += len(line)
+
+        self._active_file.write(b''.join(line for line, _ in self._buffer))
+        self._active_file.flush()
+        if self.fsync:
+            os.fsync(self._active_file.fileno())
+        self._active_size = offset
+        self._buffer = []
+
+        if self._active_size >= self.segment_size:
+            self._rotate()
+
+    # 查询
+
+    def find(self, out_trade_no=None, payjs_order_id=None):
+        """
+        按订单号查找该订单的全部记录（按写入顺序）
+
+        :param out_trade_no: 用户端订单号
+        :param payjs_order_id: PayJS 订单号
+        :return: 记录字典的列表
+        """
+        if out_trade_no:
+            field, value = 'out_trade_no', str(out_trade_no)
+        elif payjs_order_id:
+            field, value = 'payjs_order_id', str(payjs_order_id)
+        else:
+            raise InvalidInfoException(-5002, '未提供订单号')
+
+        key = _index_key(field, value)
+        with self._lock:
+            self._write_buffer()
+
+            locations = []
+            lo = bisect.bisect_left(self._index_keys, key)
+            hi = bisect.bisect_right(self._index_keys, key, lo)
+            for i in range(lo, hi):
+                _, _, segment, offset = self._index_keys.entry(i)
+                locations.append((segment, offset))
+            locations.extend(self._live.get(key, ()))
+
+            records = [self._read(segment, offset) for segment, offset in locations]
+
+        return [r for r in records if r is not None and str(r.get(field)) == value]
+
+    def unconfirmed(self):
+        """
+        列出已发起下单但尚未确认（既未支付、未关闭，也没有收到下单失败的返回）的订单，用于重启后的恢复
+
+        :return: 订单摘要字典的列表（按下单时间排序），尚未收到下单返回的订单 payjs_order_id 为 None
+        """
+        with self._lock:
+            self._write_buffer()
+            pending = [dict(v, out_trade_no=k) for k, v in self._pending.items()]
+        return sorted(pending, key=lambda x: x['t'])
+
+    def _read(self, segment, offset):
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                return json.loads(f.readline().decode())
+        except (OSError, ValueError):
+            logger.warning('无法读取日志记录 {}@{}'.format(segment, offset))
+            return None
+
+    # 段的切换与压缩
+
+    def rotate(self):
+        """
+        封存当前段并切换到新段
+        """
+        with self._lock:
+            self._write_buffer()
+            if self._active_size:
+                self._rotate()
+
+    def _rotate(self):
+        self._active_file.close()
+        self._sealed = self._active
+        self._write_index(self._index_entries() + self._live_entries())
+        self._write_pending()
+        self._live = {}
+        self._open_active(self._active + 1)
+
+    def compact(self, before: float = None):
+        """
+        压缩已封存的段：丢弃已确认订单的记录
+
+        每个段通过临时文件原子替换，全部完成后再写入新的索引；中途崩溃时索引中记录的段大小与实际不符，
+        下次打开时会重建索引
+
+        :param before: （可选）时间戳，仅丢弃早于该时间的记录，默认丢弃全部已确认订单的记录
+        """
+        with self._lock:
+            self._write_buffer()
+
+            entries = []
+            for segment in self._segments():
+                if segment > self._sealed:
+                    continue
+
+                path = self._segment_path(segment)
+                kept = []
+                with open(path, 'rb') as f:
+                    for line in f:
+                        record = json.loads(line.decode())
+                        if self._is_pending(record) or (before and record['t'] >= before):
+                            kept.append((line, record))
+
+                if not kept:
+                    os.remove(path)
+                    continue
+
+                offset = 0
+                with open(path + '.tmp', 'wb') as f:
+                    for line, record in kept:
+                        entries.extend((k, segment, offset) for k in self._record_keys(record))
+                        f.write(line)
+                        offset += len(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+
+            self._write_index(entries)
+
+    # 关闭
+
+    def close(self):
+        """
+        写入缓冲中的记录并关闭文件
+        """
+        with self._lock:
+            self._closed.set()
+            self._write_buffer()
+            self._active_file.close()
+            self._close_index()
+
+    # 内部实现
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, SEGMENT_NAME.format(segment))
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            m = SEGMENT_PATTERN.match(name)
+            if m:
+                segments.append(int(m.group(1)))
+        return sorted(segments)
+
+    @staticmethod
+    def _record_keys(record):
+        return [_index_key(field, record[field]) for field in FIELDS if record.get(field)]
+
+    def _add_live(self, record, segment, offset):
+        for key in self._record_keys(record):
+            self._live.setdefault(key, []).append((segment, offset))
+
+    def _live_entries(self):
+        return [(key, segment, offset) for key, locations in self._live.items() for segment, offset in locations]
+
+    def _is_pending(self, record):
+        return record.get('out_trade_no') in self._pending or record.get('payjs_order_id') in self._pending_ids
+
+    def _apply_pending(self, record):
+        """
+        根据一条记录更新未确认订单集合
+        """
+        out_trade_no = record.get('out_trade_no')
+        payjs_order_id = record.get('payjs_order_id')
+        if not out_trade_no and payjs_order_id:
+            out_trade_no = self._pending_ids.get(payjs_order_id)
+        if not out_trade_no:
+            return
+
+        kind = record['kind']
+        api = record.get('api')
+
+        if kind == 'intent':
+            if api in CREATE_APIS:
+                self._pending[out_trade_no] = {
+                    't': record['t'],
+                    'api': api,
+                    'payjs_order_id': None,
+                    'total_fee': record['request'].get('total_fee'),
+                }
+        elif kind == 'notify':
+            if record['ok']:
+                self._confirm(out_trade_no)
+        elif api in CREATE_APIS:
+            response = record.get('response')
+            if response is None:
+                return  # 返回无法解析时无法确定订单是否已创建，继续视为未确认
+            if api == 'micropay' and record['ok']:
+                self._confirm(out_trade_no)  # 刷卡支付返回成功即已支付，之后不会再有查询或通知
+            elif response.get('payjs_order_id'):
+                entry = self._pending.setdefault(out_trade_no, {
+                    't': record['t'],
+                    'api': api,
+                    'total_fee': record['request'].get('total_fee'),
+                })
+                entry['payjs_order_id'] = response['payjs_order_id']
+                self._pending_ids[response['payjs_order_id']] = out_trade_no
+            else:
+                self._confirm(out_trade_no)  # 下单失败，订单未创建
+        elif api == 'check':
+            if record['ok'] and str((record.get('response') or {}).get('status')) == '1':
+                self._confirm(out_trade_no)
+        elif api == 'close':
+            if record['ok']:
+                self._confirm(out_trade_no)
+
+    def _confirm(self, out_trade_no):
+        entry = self._pending.pop(out_trade_no, None)
+        if entry and entry.get('payjs_order_id'):
+            self._pending_ids.pop(entry['payjs_order_id'], None)
+
+    def _open_index(self):
+        """
+        打开并 mmap 索引文件
+
+        :return: 索引文件存在但已损坏时返回 False
+        """
+        path = os.path.join(self.path, INDEX_NAME)
+        if not os.path.exists(path):
+            return True
+
+        self._index_file = open(path, 'rb')
+        size = os.fstat(self._index_file.fileno()).st_size
+        if size < INDEX_HEADER.size:
+            logger.warning('索引文件损坏，将重建')
+            self._close_index()
+            return False
+
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._sealed, segment_count = INDEX_HEADER.unpack_from(self._index_map)
+        if magic != INDEX_MAGIC:
+            logger.warning('索引文件格式错误，将重建')
+            self._close_index()
+            return False
+        base = INDEX_HEADER.size + segment_count * INDEX_SEGMENT.size
+        self._index_segments = dict(INDEX_SEGMENT.iter_unpack(self._index_map[INDEX_HEADER.size:base]))
+        self._index_keys = _IndexKeys(self._index_map, (size - base) // INDEX_ENTRY.size, base)
+        return True
+
+    def _close_index(self):
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._index_keys = _IndexKeys(b'', 0)
+        self._index_segments = {}
+
+    def _index_entries(self):
+        entries = []
+        for i in range(len(self._index_keys)):
+            _, _, segment, offset = self._index_keys.entry(i)
+            entries.append((self._index_keys[i], segment, offset))
+        return entries
+
+    def _sealed_segment_sizes(self):
+        return {segment: os.path.getsize(self._segment_path(segment))
+                for segment in self._segments() if segment <= self._sealed}
+
+    def _index_matches_segments(self):
+        return self._index_segments == self._sealed_segment_sizes()
+
+    def _rebuild_index(self):
+        """
+        扫描全部已封存的段重建索引
+        """
+        entries = []
+        for segment in self._segments():
+            if segment > self._sealed:
+                continue
+            offset = 0
+            for line, record in self._scan(segment):
+                entries.extend((key, segment, offset) for key in self._record_keys(record))
+                offset += len(line)
+        self._write_index(entries)
+
+    def _write_index(self, entries):
+        """
+        写入新的索引文件（先写临时文件再替换）并重新 mmap
+        """
+        entries.sort()
+        path = os.path.join(self.path, INDEX_NAME)
+        segments = sorted(self._sealed_segment_sizes().items())
+        with open(path + '.tmp', 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self._sealed, len(segments)))
+            for segment, size in segments:
+                f.write(INDEX_SEGMENT.pack(segment, size))
+            for key, segment, offset in entries:
+                f.write(INDEX_ENTRY.pack(key[:1], key[1:], segment, offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._close_index()
+        os.replace(path + '.tmp', path)
+        self._open_index()
+
+    def _write_pending(self):
+        path = os.path.join(self.path, PENDING_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'sealed': self._sealed, 'pending': self._pending}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _recover(self):
+        """
+        读取未确认订单快照，并重放快照与索引之后的段
+        """
+        pending_sealed = 0
+        try:
+            with open(os.path.join(self.path, PENDING_NAME)) as f:
+                snapshot = json.load(f)
+            self._pending = snapshot['pending']
+            pending_sealed = snapshot['sealed']
+        except (OSError, ValueError, KeyError):
+            self._pending = {}
+        self._pending_ids = {v['payjs_order_id']: k for k, v in self._pending.items() if v.get('payjs_order_id')}
+
+        segments = self._segments()
+        active = segments[-1] if segments else self._sealed + 1
+
+        for segment in segments:
+            if segment <= min(self._sealed, pending_sealed):
+                continue
+            offset = 0
+            for line, record in self._scan(segment, truncate=segment == active):
+                if segment > self._sealed:
+                    self._add_live(record, segment, offset)
+                if segment > pending_sealed:
+                    self._apply_pending(record)
+                offset += len(line)
+
+        self._open_active(max(active, self._sealed + 1))
+
+    def _scan(self, segment, truncate=False):
+        """
+        逐条读取段中的记录；对当前段截掉崩溃时写了一半的最后一条记录
+        """
+        path = self._segment_path(segment)
+        records = []
+        good = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    records.append((line, json.loads(line.decode())))
+                except ValueError:
+                    logger.warning('日志 {} 在偏移 {} 处存在不完整的记录'.format(path, good))
+                    break
+                good += len(line)
+
+        if truncate and good != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+                f.flush()
+                os.fsync(f.fileno())
+
+        return records
+
+    def _open_active(self, segment):
+        self._active = segment
+        self._active_file = open(self._segment_path(segment), 'ab')
+        self._active_size = self._active_file.tell()
+
+    def __repr__(self):
+        return '<OrderJournal {} sealed={} active={}>'.format(self.path, self._sealed, self._active)
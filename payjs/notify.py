@@ -7,7 +7,7 @@ logger = logging.getLogger(__name__)
 
 
 class PayJSNotify:
-    def __init__(self, key: str, notify_content, mchid=None):
+    def __init__(self, key: str, notify_content, mchid=None, journal=None, tracker=None):
         if type(notify_content) is str:
             from urllib import parse
             notify = dict(parse.parse_qsl(notify_content))
@@ -46,6 +46,11 @@ class PayJSNotify:
 
         self.mchid = notify['mchid']
 
+        if journal is not None:
+            journal.record_notify(self)
+        if tracker is not None:
+            tracker.ingest_notify(self)
+
     def as_dict(self, params=None):
         if params is None:
             params = (
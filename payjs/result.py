@@ -1,14 +1,16 @@
 import logging
 from pprint import pformat
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
 
 class PayJSResultBase:
-    def __init__(self, raw_response, r_json: dict = None):
+    def __init__(self, raw_response, r_json: dict = None, api: str = None):
         self.raw_response = raw_response  # 原始 requests.Response 数据
         self.content = raw_response.content  # 原始 response 的 content
         self.url = raw_response.url  # 请求的 url
+        self.api = api or urlparse(self.url).path.rstrip('/').rsplit('/', 1)[-1]  # 接口名（如 check、cashier）
         self.STATUS_CODE = raw_response.status_code  # HTTP 请求返回的状态吗
         self.json = r_json  # 请求返回的内容包装后的 JSON 值（以 dict 存储或为 None/False）
         self.JSON = self.json
@@ -35,10 +37,13 @@ class PayJSResultSuccess(PayJSResultBase):
                 if k not in ['sign']:
                     setattr(self, k, v)
 
-        if '/api/check' in self.url:
+        if self.api == 'check':
             self.PAID = True if getattr(self, 'status') == 1 else False  # 是否已支付
             self.paid = self.PAID
-        if '/api/cashier' in self.url:
+        if self.api == 'micropay':
+            self.PAID = True  # 刷卡支付返回成功即已支付（需要用户输入密码时返回失败）
+            self.paid = self.PAID
+        if self.api == 'cashier':
             self.REDIRECT = raw_response.headers.get('Location')
             self.redirect = self.REDIRECT
 
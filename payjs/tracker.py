@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from payjs.exceptions import InvalidInfoException
+from payjs.notify import PayJSNotify
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'created'
+PAID = 'paid'
+CLOSED = 'closed'
+REFUNDED = 'refunded'
+
+TERMINAL_STATES = (PAID, CLOSED, REFUNDED)
+
+# 允许的状态迁移，不在其中的迁移（例如通知先于下单结果到达后再收到下单结果）会被忽略
+TRANSITIONS = {
+    CREATED: (PAID, CLOSED, REFUNDED),  # 可能错过了支付结果，直接收到退款结果
+    PAID: (REFUNDED,),
+    CLOSED: (),
+    REFUNDED: (),
+}
+
+CREATE_APIS = ('native', 'jsapi', 'micropay')
+
+OrderRecord = namedtuple('OrderRecord', (
+    'out_trade_no', 'payjs_order_id', 'state', 'total_fee', 'transaction_id', 'updated',
+))
+
+
+class OrderTracker:
+    """
+    内存中的订单状态跟踪
+
+    汇总下单结果、订单查询结果与异步通知，为每笔订单保存一条 OrderRecord，可同时按 out_trade_no 与 payjs_order_id 查询
+    处于终态（已支付、已关闭、已退款）的订单超过 max_terminal 条、未支付的订单超过 max_pending 条时，
+    分别按最近更新时间淘汰最早的（例如用户扫码后未支付的订单）
+    OrderRecord 不可变，写入时加锁并整体替换，因此查询无需加锁
+    """
+
+    def __init__(self, max_terminal: int = 10000, max_pending: int = 10000):
+        """
+        初始化
+
+        :param max_terminal: （默认为 10000）最多保留多少条处于终态的订单
+        :param max_pending: （默认为 10000）最多保留多少条未支付的订单
+        """
+        self.max_terminal = max_terminal
+        self.max_pending = max_pending
+
+        self._by_out_trade_no = {}
+        self._by_payjs_order_id = {}
+        self._terminal = OrderedDict()  # 处于终态的订单，按更新先后排列，用于淘汰
+        self._pending = OrderedDict()  # 未支付的订单，按更新先后排列，用于淘汰
+        self._lock = threading.Lock()
+
+    def get(self, out_trade_no=None, payjs_order_id=None):
+        """
+        查询订单状态
+
+        :param out_trade_no: 用户端订单号
+        :param payjs_order_id: PayJS 订单号
+        :return: OrderRecord，未跟踪该订单时为 None
+        """
+        if payjs_order_id:
+            return self._by_payjs_order_id.get(str(payjs_order_id))
+        if out_trade_no:
+            return self._by_out_trade_no.get(str(out_trade_no))
+        raise InvalidInfoException(-2005, '未提供订单号')
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_payjs_order_id) + sum(
+                1 for record in self._by_out_trade_no.values() if not record.payjs_order_id)
+
+    def ingest(self, item):
+        """
+        汇总一个 PayJSResult 或 PayJSNotify
+
+        :return: 更新后的 OrderRecord，无法识别的内容返回 None
+        """
+        if isinstance(item, PayJSNotify):
+            return self.ingest_notify(item)
+        return self.ingest_result(item)
+
+    def ingest_notify(self, notify: PayJSNotify):
+        """
+        汇总一条已通过签名校验的异步通知
+        """
+        if not notify.paid:
+            return None
+        return self._update(notify.out_trade_no, notify.payjs_order_id, PAID, total_fee=notify.total_fee,
+                            transaction_id=notify.transaction_id)
+
+    def ingest_result(self, result):
+        """
+        汇总一个接口返回的 PayJSResult（下单、订单查询、关闭订单与退款）
+        """
+        if type(result.json) is not dict:
+            return None
+
+        j = result.json
+        api = result.api
+        out_trade_no = j.get('out_trade_no')
+        payjs_order_id = j.get('payjs_order_id')
+
+        if api == 'micropay' and result:
+            # 刷卡支付返回成功即已支付，之后不会再收到异步通知
+            state = PAID
+        elif api in CREATE_APIS and payjs_order_id:
+            # 刷卡支付等待用户输入密码时返回失败但已创建订单
+            state = CREATED
+        elif not result:
+            return None
+        elif api == 'check':
+            state = PAID if str(j.get('status')) == '1' else CREATED
+        elif api == 'close':
+            state = CLOSED
+        elif api == 'refund':
+            state = REFUNDED
+        else:
+            return None
+
+        return self._update(out_trade_no, payjs_order_id, state, total_fee=j.get('total_fee'),
+                            transaction_id=j.get('transaction_id'))
+
+    def _update(self, out_trade_no, payjs_order_id, state, total_fee=None, transaction_id=None):
+        out_trade_no = str(out_trade_no) if out_trade_no else None
+        payjs_order_id = str(payjs_order_id) if payjs_order_id else None
+        if not out_trade_no and not payjs_order_id:
+            return None
+
+        with self._lock:
+            old = None
+            if payjs_order_id:
+                old = self._by_payjs_order_id.get(payjs_order_id)
+            if old is None and out_trade_no:
+                old = self._by_out_trade_no.get(out_trade_no)
+
+            if old is None:
+                record = OrderRecord(out_trade_no, payjs_order_id, state, total_fee, transaction_id, time.time())
+            else:
+                if state != old.state and state not in TRANSITIONS[old.state]:
+                    logger.debug('忽略订单 {} 的状态迁移 {} -> {}'.format(payjs_order_id or out_trade_no, old.state,
+                                                                   state))
+                    state = old.state
+                record = OrderRecord(
+                    out_trade_no or old.out_trade_no,
+                    payjs_order_id or old.payjs_order_id,
+                    state,
+                    total_fee if total_fee is not None else old.total_fee,
+                    transaction_id or old.transaction_id,
+                    time.time(),
+                )
+                self._terminal.pop(_record_key(old), None)
+                self._pending.pop(_record_key(old), None)
+
+            if record.out_trade_no:
+                self._by_out_trade_no[record.out_trade_no] = record
+            if record.payjs_order_id:
+                self._by_payjs_order_id[record.payjs_order_id] = record
+
+            if record.state in TERMINAL_STATES:
+                self._store(self._terminal, self.max_terminal, record)
+            else:
+                self._store(self._pending, self.max_pending, record)
+
+        return record
+
+    def _store(self, records, limit, record):
+        records[_record_key(record)] = record
+        while len(records) > limit:
+            self._evict(records.popitem(last=False)[1])
+
+    def _evict(self, record):
+        if record.out_trade_no and self._by_out_trade_no.get(record.out_trade_no) is record:
+            del self._by_out_trade_no[record.out_trade_no]
+        if record.payjs_order_id and self._by_payjs_order_id.get(record.payjs_order_id) is record:
+            del self._by_payjs_order_id[record.payjs_order_id]
+
+    def __repr__(self):
+        return '<OrderTracker tracked={} pending={} terminal={}>'.format(len(self), len(self._pending),
+                                                                       len(self._terminal))
+
+
+def _record_key(record):
+    return record.payjs_order_id or ('out_trade_no', record.out_trade_no)
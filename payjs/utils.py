@@ -6,7 +6,7 @@ def check_url(url=None, force_ssl=True):
     检测回调 URL 是否符合规范
     目前支持普通网址（纯网址必须以/结尾）、带端口的网址、纯 IP 地址、中文网址（需先进行 PunyCode 编码）
 
-    默认只支持 https，要想支持 HTTP 请手动设置实例的 FORCE_SSL 为 False
+    默认只支持 https，要想支持 HTTP 请在初始化实例时传入 FORCE_SSL=False
     :param url: 要检测的网址
     :param force_ssl: 是否强制使用 https
     :return: 是否通过（空网址直接通过）
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from payjs.sign import get_signature
+
+MCHID = 'test-mchid'
+KEY = 'test-key'
+
+
+class SlowBody:
+    """
+    先返回响应头，再在 seconds 秒内逐字节返回内容
+    """
+
+    def __init__(self, body, seconds):
+        self.body = body
+        self.seconds = seconds
+
+
+class StandIn:
+    """
+    本地模拟 payjs.cn 的 HTTP 服务
+
+    behaviors 按接口名（如 check）设置返回：behavior(data, n) 的参数为请求参数与该接口的第几次调用（从 0 开始），
+    返回 dict（自动签名）、SlowBody，或 None 表示不返回内容直接断开连接；behavior 中可以 sleep 模拟延迟
+    """
+
+    def __init__(self):
+        self.behaviors = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                data = dict(parse_qsl(self.rfile.read(length).decode()))
+                api = self.path.rstrip('/').rsplit('/', 1)[-1]
+                with stand_in.lock:
+                    n = sum(1 for a, _ in stand_in.calls if a == api)
+                    stand_in.calls.append((api, data))
+
+                behavior = stand_in.behaviors.get(api, default_behavior)
+                ret = behavior(data, n)
+                if ret is None:
+                    self.close_connection = True
+                    return
+
+                slow = ret if isinstance(ret, SlowBody) else None
+                body = dict(slow.body if slow else ret)
+                body['sign'] = get_signature(KEY, body)
+                content = json.dumps(body).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                try:
+                    if slow is None:
+                        self.wfile.write(content)
+                        return
+                    for i in range(len(content)):
+                        self.wfile.write(content[i:i + 1])
+                        self.wfile.flush()
+                        time.sleep(slow.seconds / len(content))
+                except OSError:
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address
+        return 'http://{}:{}/api'.format(host, port)
+
+    def count(self, api):
+        with self.lock:
+            return sum(1 for a, _ in self.calls if a == api)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def default_behavior(data, n):
+    return {
+        'return_code': 1,
+        'mchid': MCHID,
+        'payjs_order_id': data.get('payjs_order_id') or 'p-' + data.get('out_trade_no', ''),
+        'out_trade_no': data.get('out_trade_no') or 'o-' + data.get('payjs_order_id', ''),
+        'status': 1,
+    }
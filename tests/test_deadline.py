@@ -0,0 +1,91 @@
+import time
+import unittest
+
+from payjs import PayJS
+from payjs.exceptions import DeadlineExceededException
+
+from tests.stand_in import KEY, MCHID, SlowBody, StandIn, default_behavior
+
+
+def slow_first(seconds, count=1):
+    def behavior(data, n):
+        if n < count:
+            time.sleep(seconds)
+        return default_behavior(data, n)
+    return behavior
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = StandIn()
+
+    def tearDown(self):
+        self.stand_in.close()
+
+    def client(self, **kwargs):
+        return PayJS(MCHID, KEY, API_BASE=self.stand_in.api_base, **kwargs)
+
+    def assertPoolClean(self, p):
+        self.assertTrue(all(not channel.aborted for channel in p._channels))
+
+    def test_deadline_exceeded_on_slow_body(self):
+        self.stand_in.behaviors['refund'] = lambda data, n: SlowBody(default_behavior(data, n), 3)
+        p = self.client()
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceededException):
+            p.refund('p1', timeout=0.3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertPoolClean(p)
+
+        self.stand_in.behaviors['refund'] = default_behavior
+        self.assertTrue(p.refund('p1', timeout=1))
+
+    def test_hedge_wins_and_loser_is_not_pooled(self):
+        self.stand_in.behaviors['check'] = slow_first(2)
+        p = self.client(HEDGE_PERCENTILE=95, HEDGE_DELAY=0.1)
+
+        start = time.monotonic()
+        r = p.check_status(payjs_order_id='p1', timeout=5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(r.paid)
+        self.assertEqual(self.stand_in.count('check'), 2)
+
+        time.sleep(0.1)
+        self.assertPoolClean(p)
+        for i in range(3):
+            self.assertTrue(p.refund('p{}'.format(i), timeout=1))
+
+    def test_fast_failure_is_retried_once(self):
+        self.stand_in.behaviors['check'] = lambda data, n: None if n == 0 else default_behavior(data, n)
+        p = self.client(HEDGE_PERCENTILE=95, HEDGE_DELAY=5)
+
+        start = time.monotonic()
+        r = p.check_status(payjs_order_id='p1', timeout=3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(r.paid)
+        self.assertEqual(self.stand_in.count('check'), 2)
+
+    def test_hedge_without_deadline_uses_hedge_timeout(self):
+        self.stand_in.behaviors['check'] = slow_first(3, count=2)
+        p = self.client(HEDGE_PERCENTILE=95, HEDGE_DELAY=0.1, HEDGE_TIMEOUT=0.5)
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceededException):
+            p.check_status(payjs_order_id='p1')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.stand_in.count('check'), 2)
+
+    def test_aborted_attempts_are_recorded_as_latency(self):
+        self.stand_in.behaviors['check'] = slow_first(2)
+        p = self.client(HEDGE_PERCENTILE=95, HEDGE_DELAY=0.2)
+
+        p.check_status(payjs_order_id='p1', timeout=5)
+        time.sleep(0.1)
+        samples = sorted(p._latencies[p.API_BASE + '/check'])
+        self.assertEqual(len(samples), 2)
+        self.assertGreaterEqual(samples[-1], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from payjs.journal import OrderJournal
+
+
+class FakeResult:
+    def __init__(self, ok, j):
+        self.ok = ok
+        self.json = j
+
+    def __bool__(self):
+        return self.ok
+
+
+def create(journal, i, respond=True):
+    data = {'mchid': 'm', 'total_fee': 100 + i, 'out_trade_no': 'o{}'.format(i), 'body': 'test', 'sign': 'x'}
+    journal.record_intent('native', data)
+    if respond:
+        journal.record_request('native', data, FakeResult(True, {
+            'return_code': 1, 'out_trade_no': 'o{}'.format(i), 'payjs_order_id': 'p{}'.format(i),
+        }))
+
+
+def check(journal, i, paid=True):
+    data = {'payjs_order_id': 'p{}'.format(i)}
+    journal.record_intent('check', data)
+    journal.record_request('check', data, FakeResult(True, {
+        'return_code': 1, 'out_trade_no': 'o{}'.format(i), 'payjs_order_id': 'p{}'.format(i),
+        'status': 1 if paid else 0,
+    }))
+
+
+def unconfirmed(journal):
+    return sorted(x['out_trade_no'] for x in journal.unconfirmed())
+
+
+class OrderJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith('seg-'))
+
+    def test_torn_tail_is_truncated(self):
+        journal = OrderJournal(self.path)
+        create(journal, 1)
+        journal.close()
+
+        segment = os.path.join(self.path, self.segments()[-1])
+        size = os.path.getsize(segment)
+        with open(segment, 'ab') as f:
+            f.write(b'{"t":1,"kind":"intent","api":"nat')
+
+        journal = OrderJournal(self.path)
+        self.assertEqual(os.path.getsize(segment), size)
+        create(journal, 2)
+        self.assertEqual(len(journal.find(out_trade_no='o1')), 2)
+        self.assertEqual(len(journal.find(out_trade_no='o2')), 2)
+        journal.close()
+
+    def test_reopen_after_rotation(self):
+        journal = OrderJournal(self.path, segment_size=300)
+        for i in range(6):
+            create(journal, i)
+        journal.close()
+        self.assertGreater(len(self.segments()), 2)
+
+        journal = OrderJournal(self.path, segment_size=300)
+        for i in range(6):
+            self.assertEqual([r['kind'] for r in journal.find(out_trade_no='o{}'.format(i))], ['intent', 'request'])
+        create(journal, 6)
+        self.assertEqual(len(journal.find(payjs_order_id='p6')), 1)
+        journal.close()
+
+    def test_unconfirmed_after_restart(self):
+        journal = OrderJournal(self.path, segment_size=400)
+        create(journal, 1)
+        create(journal, 2)
+        check(journal, 2)
+        create(journal, 3, respond=False)  # 发送后崩溃，没有收到返回
+        create(journal, 4)
+        check(journal, 4, paid=False)
+        data = {'mchid': 'm', 'total_fee': 1, 'out_trade_no': 'o5'}
+        journal.record_intent('native', data)
+        journal.record_request('native', data, FakeResult(False, {'return_code': 0, 'msg': 'fail'}))
+        data = {'payjs_order_id': 'p1'}
+        journal.record_intent('close', data)
+        journal.record_request('close', data, FakeResult(True, {'return_code': 1, 'payjs_order_id': 'p1'}))
+        self.assertEqual(unconfirmed(journal), ['o3', 'o4'])
+        journal.close()
+
+        journal = OrderJournal(self.path, segment_size=400)
+        self.assertEqual(unconfirmed(journal), ['o3', 'o4'])
+        pending = {x['out_trade_no']: x for x in journal.unconfirmed()}
+        self.assertIsNone(pending['o3']['payjs_order_id'])
+        self.assertEqual(pending['o4']['payjs_order_id'], 'p4')
+        journal.close()
+
+    def test_micropay_success_is_confirmed(self):
+        journal = OrderJournal(self.path)
+        for i, ok in ((1, True), (2, False)):
+            data = {'mchid': 'm', 'total_fee': 1, 'out_trade_no': 'o{}'.format(i), 'auth_code': '1' * 18}
+            journal.record_intent('micropay', data)
+            journal.record_request('micropay', data, FakeResult(ok, {
+                'return_code': 1 if ok else 0, 'out_trade_no': 'o{}'.format(i), 'payjs_order_id': 'p{}'.format(i),
+            }))
+        self.assertEqual(unconfirmed(journal), ['o2'])
+        journal.close()
+
+        journal = OrderJournal(self.path)
+        self.assertEqual(unconfirmed(journal), ['o2'])
+        journal.close()
+
+    def test_batch_is_flushed_after_interval(self):
+        journal = OrderJournal(self.path, batch_size=100, flush_interval=0.1)
+        create(journal, 1)
+        segment = os.path.join(self.path, self.segments()[-1])
+        self.assertEqual(os.path.getsize(segment), 0)
+        time.sleep(0.3)
+        self.assertGreater(os.path.getsize(segment), 0)
+        journal.close()
+
+    def test_damaged_index_is_rebuilt(self):
+        journal = OrderJournal(self.path, segment_size=300)
+        for i in range(6):
+            create(journal, i)
+        journal.close()
+        with open(os.path.join(self.path, 'index.idx'), 'wb') as f:
+            f.write(b'broken')
+
+        journal = OrderJournal(self.path, segment_size=300)
+        self.assertEqual(journal._sealed, int(self.segments()[-2][4:12]))
+        self.assertGreater(len(journal._index_keys), 0)
+        for i in range(6):
+            self.assertEqual(len(journal.find(out_trade_no='o{}'.format(i))), 2)
+        journal.close()
+
+    def test_find_across_sealed_and_live_segments(self):
+        journal = OrderJournal(self.path)
+        create(journal, 1)
+        journal.rotate()
+        check(journal, 1, paid=False)
+
+        records = journal.find(payjs_order_id='p1')
+        self.assertEqual([r['api'] for r in records], ['native', 'check', 'check'])
+        self.assertEqual(len(journal.find(out_trade_no='o1')), 3)
+        self.assertEqual(journal.find(out_trade_no='o9'), [])
+        journal.close()
+
+    def test_compact_keeps_unconfirmed_orders(self):
+        journal = OrderJournal(self.path, segment_size=300)
+        for i in range(6):
+            create(journal, i)
+        for i in range(0, 6, 2):
+            check(journal, i)
+        journal.rotate()
+        journal.compact()
+
+        self.assertEqual(unconfirmed(journal), ['o1', 'o3', 'o5'])
+        self.assertEqual(journal.find(out_trade_no='o0'), [])
+        self.assertEqual(len(journal.find(out_trade_no='o1')), 2)
+        journal.close()
+
+        journal = OrderJournal(self.path)
+        self.assertEqual(len(journal.find(out_trade_no='o3')), 2)
+        self.assertEqual(unconfirmed(journal), ['o1', 'o3', 'o5'])
+        journal.close()
+
+    def test_crash_during_compaction_rebuilds_index(self):
+        journal = OrderJournal(self.path)  # 所有记录在同一段中，压缩后未确认订单的偏移会改变
+        for i in range(6):
+            create(journal, i)
+        for i in range(0, 6, 2):
+            check(journal, i)
+        journal.rotate()
+        with mock.patch.object(OrderJournal, '_write_index', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                journal.compact()
+
+        journal = OrderJournal(self.path)
+        for i in (1, 3, 5):
+            self.assertEqual(len(journal.find(out_trade_no='o{}'.format(i))), 2)
+        self.assertEqual(unconfirmed(journal), ['o1', 'o3', 'o5'])
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from payjs import PayJS, OrderTracker
+from payjs.tracker import PAID
+
+from tests.stand_in import KEY, MCHID, StandIn
+
+AUTH_CODE = '134567890123456789'
+
+
+class MicropayWaitTest(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = StandIn()
+        self.paid = threading.Event()
+        self.stand_in.behaviors['micropay'] = self.micropay_pending
+        self.stand_in.behaviors['check'] = self.check
+        self.stand_in.behaviors['close'] = lambda data, n: {'return_code': 1, 'payjs_order_id': data['payjs_order_id']}
+
+    def tearDown(self):
+        self.stand_in.close()
+
+    def client(self, **kwargs):
+        return PayJS(MCHID, KEY, API_BASE=self.stand_in.api_base, **kwargs)
+
+    @staticmethod
+    def micropay_pending(data, n):
+        # 需要用户输入密码：返回失败，但已创建订单
+        return {'return_code': 0, 'msg': 'USERPAYING', 'out_trade_no': data['out_trade_no'], 'payjs_order_id': 'p1'}
+
+    def check(self, data, n):
+        return {'return_code': 1, 'out_trade_no': 'o1', 'payjs_order_id': data['payjs_order_id'],
+                'status': 1 if self.paid.is_set() else 0}
+
+    def wait_for_close(self, seconds=2):
+        end = time.monotonic() + seconds
+        while self.stand_in.count('close') == 0 and time.monotonic() < end:
+            time.sleep(0.02)
+        return self.stand_in.count('close')
+
+    def test_immediate_success(self):
+        self.stand_in.behaviors['micropay'] = lambda data, n: {
+            'return_code': 1, 'out_trade_no': data['out_trade_no'], 'payjs_order_id': 'p1', 'total_fee': 1}
+        tracker = OrderTracker()
+        p = self.client(tracker=tracker)
+
+        start = time.monotonic()
+        r = p.micropay_and_wait(1, 'o1', AUTH_CODE)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(r and r.paid)
+        self.assertEqual(r.check_count, 0)
+        self.assertEqual(self.stand_in.count('check'), 0)
+        self.assertEqual(tracker.get(out_trade_no='o1').state, PAID)
+
+    def test_paid_while_polling(self):
+        threading.Timer(0.25, self.paid.set).start()
+        r = self.client().micropay_and_wait(1, 'o1', AUTH_CODE, timeout=5, schedule=(0.1,))
+        self.assertTrue(r and r.paid)
+        self.assertFalse(r.timeout)
+        self.assertEqual(self.stand_in.count('close'), 0)
+
+    def test_deadline_closes_order(self):
+        start = time.monotonic()
+        r = self.client().micropay_and_wait(1, 'o1', AUTH_CODE, timeout=0.5, schedule=(0.1,))
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertTrue(r.timeout)
+        self.assertFalse(r.paid)
+        self.assertTrue(r.close_result)
+        self.assertEqual(self.stand_in.count('close'), 1)
+
+    def test_cancel_event_closes_order(self):
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+
+        start = time.monotonic()
+        r = self.client().micropay_and_wait(1, 'o1', AUTH_CODE, timeout=10, schedule=(5,), cancel_event=cancel)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(r.cancelled)
+        self.assertTrue(r.close_result)
+        self.assertEqual(self.stand_in.count('close'), 1)
+
+    def test_tracker_wakes_wait(self):
+        tracker = OrderTracker()
+        p = self.client(tracker=tracker)
+
+        def paid():
+            self.paid.set()
+            tracker._update('o1', 'p1', PAID)
+
+        threading.Timer(0.3, paid).start()
+        start = time.monotonic()
+        r = p.micropay_and_wait(1, 'o1', AUTH_CODE, timeout=10, schedule=(5,))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(r and r.paid)
+        self.assertEqual(r.check_count, 1)
+
+    def test_task_cancellation_closes_order(self):
+        p = self.client()
+
+        async def main():
+            task = asyncio.ensure_future(p.micropay_and_wait_async(1, 'o1', AUTH_CODE, timeout=10, schedule=(5,)))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        self.assertEqual(self.stand_in.count('close'), 1)
+
+    def test_task_cancelled_during_micropay_closes_order(self):
+        def slow_micropay(data, n):
+            time.sleep(0.4)
+            return self.micropay_pending(data, n)
+
+        self.stand_in.behaviors['micropay'] = slow_micropay
+        p = self.client()
+
+        async def main():
+            task = asyncio.ensure_future(p.micropay_and_wait_async(1, 'o1', AUTH_CODE, timeout=10))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        self.assertEqual(self.wait_for_close(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+from payjs import PayJSNotify
+from payjs.sign import get_signature
+from payjs.tracker import OrderTracker, CREATED, PAID, CLOSED, REFUNDED
+
+
+class FakeResult:
+    def __init__(self, api, ok, j):
+        self.api = api
+        self.ok = ok
+        self.json = j
+
+    def __bool__(self):
+        return self.ok
+
+
+def result(api, out_trade_no=None, payjs_order_id=None, ok=True, **kwargs):
+    j = {'return_code': 1 if ok else 0, 'out_trade_no': out_trade_no, 'payjs_order_id': payjs_order_id}
+    j.update(kwargs)
+    return FakeResult(api, ok, j)
+
+
+def notify(out_trade_no, payjs_order_id, key='k'):
+    data = {
+        'return_code': '1', 'total_fee': '100', 'out_trade_no': out_trade_no, 'payjs_order_id': payjs_order_id,
+        'transaction_id': 't-' + payjs_order_id, 'time_end': '2026-01-01 12:00:00', 'openid': 'o', 'attach': '',
+        'mchid': 'm',
+    }
+    data['sign'] = get_signature(key, data)
+    return PayJSNotify(key, data)
+
+
+class OrderTrackerTest(unittest.TestCase):
+    def assertConsistent(self, tracker):
+        for out_trade_no, record in tracker._by_out_trade_no.items():
+            self.assertEqual(record.out_trade_no, out_trade_no)
+            if record.payjs_order_id:
+                self.assertIs(tracker._by_payjs_order_id[record.payjs_order_id], record)
+        for payjs_order_id, record in tracker._by_payjs_order_id.items():
+            self.assertEqual(record.payjs_order_id, payjs_order_id)
+            if record.out_trade_no:
+                self.assertIs(tracker._by_out_trade_no[record.out_trade_no], record)
+        self.assertEqual(len(tracker), len(tracker._pending) + len(tracker._terminal))
+
+    def test_transitions(self):
+        tracker = OrderTracker()
+        self.assertEqual(tracker.ingest(result('native', 'o1', 'p1')).state, CREATED)
+        self.assertEqual(tracker.ingest(result('check', 'o1', 'p1', status=0)).state, CREATED)
+        self.assertEqual(tracker.ingest(notify('o1', 'p1')).state, PAID)
+        self.assertEqual(tracker.ingest(result('close', payjs_order_id='p1')).state, PAID)
+        self.assertEqual(tracker.ingest(result('refund', payjs_order_id='p1')).state, REFUNDED)
+
+        tracker.ingest(result('native', 'o2', 'p2'))
+        self.assertEqual(tracker.ingest(result('refund', payjs_order_id='p2')).state, REFUNDED)
+
+        tracker.ingest(result('native', 'o3', 'p3'))
+        self.assertEqual(tracker.ingest(result('close', payjs_order_id='p3')).state, CLOSED)
+        self.assertEqual(tracker.ingest(result('check', 'o3', 'p3', status=1)).state, CLOSED)
+        self.assertConsistent(tracker)
+
+    def test_notify_before_create_result(self):
+        tracker = OrderTracker()
+        tracker.ingest(notify('o1', 'p1'))
+        record = tracker.ingest(result('native', 'o1', 'p1'))
+        self.assertEqual(record.state, PAID)
+        self.assertEqual(record.transaction_id, 't-p1')
+        self.assertEqual(tracker.get(out_trade_no='o1').state, PAID)
+
+    def test_lookup_after_key_changes(self):
+        tracker = OrderTracker()
+        tracker.ingest(result('check', out_trade_no='o1', status=0))
+        self.assertIsNone(tracker.get(payjs_order_id='p1'))
+
+        tracker.ingest(result('check', 'o1', 'p1', status=0))
+        self.assertIs(tracker.get(out_trade_no='o1'), tracker.get(payjs_order_id='p1'))
+        self.assertEqual(len(tracker), 1)
+        self.assertEqual(len(tracker._pending), 1)
+
+        tracker.ingest(notify('o1', 'p1'))
+        self.assertEqual(tracker.get(out_trade_no='o1').state, PAID)
+        self.assertEqual(tracker.get(payjs_order_id='p1').state, PAID)
+        self.assertEqual((len(tracker._pending), len(tracker._terminal)), (0, 1))
+        self.assertConsistent(tracker)
+
+    def test_eviction(self):
+        tracker = OrderTracker(max_terminal=2, max_pending=3)
+        for i in range(6):
+            tracker.ingest(result('native', 'o{}'.format(i), 'p{}'.format(i)))
+        self.assertEqual(len(tracker), 3)
+        self.assertIsNone(tracker.get(out_trade_no='o2'))
+        self.assertIsNone(tracker.get(payjs_order_id='p2'))
+
+        for i in range(3, 6):
+            tracker.ingest(notify('o{}'.format(i), 'p{}'.format(i)))
+        self.assertEqual(len(tracker), 2)
+        self.assertIsNone(tracker.get(out_trade_no='o3'))
+        self.assertEqual(tracker.get(payjs_order_id='p5').state, PAID)
+
+        tracker.ingest(result('check', out_trade_no='o9', status=0))
+        self.assertEqual(len(tracker), 3)
+        self.assertConsistent(tracker)
+
+    def test_micropay_success_is_paid(self):
+        tracker = OrderTracker()
+        self.assertEqual(tracker.ingest(result('micropay', 'o1', 'p1')).state, PAID)
+        self.assertEqual(tracker.ingest(result('micropay', 'o2', 'p2', ok=False)).state, CREATED)
+        self.assertIsNone(tracker.ingest(result('micropay', 'o3', ok=False)))
+
+
+if __name__ == '__main__':
+    unittest.main()